@@ -0,0 +1,823 @@
+# app_core.py (shared pieces: MCP session, tool discovery, LLM routing, forms, rendering)
+import os
+import re
+import orjson
+import time
+import atexit
+import itertools
+import asyncio
+import threading
+import selectors
+import subprocess
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Optional
+import pandas as pd
+import streamlit as st
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage, HumanMessage
+
+# =========================
+# CONFIG / CLIENTS
+# =========================
+@st.cache_resource
+def get_llm() -> ChatOpenAI:
+    """Load .env and build the OpenAI client once per process, not per rerun."""
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        # Not cached: raising lets the next rerun retry after the key is set
+        raise RuntimeError("OPENAI_API_KEY not set in environment")
+    return ChatOpenAI(
+        model_name="gpt-4.1-nano-2025-04-14",
+        temperature=0,
+        openai_api_key=api_key,
+        # JSON mode: the router reply is always a single valid JSON object
+        model_kwargs={"response_format": {"type": "json_object"}},
+    )
+
+# =========================
+# DEBUG STORE
+# =========================
+# Opt-in: APP_DEBUG=1 enables the debug log. Call sites check DEBUG first so
+# production runs skip the message formatting entirely.
+DEBUG = os.getenv("APP_DEBUG") == "1"
+DEBUG_MAX_MSGS = 200
+
+def debug_reset():
+    st.session_state["debug_msgs"] = deque(maxlen=DEBUG_MAX_MSGS)
+    st.session_state["last_llm_route"] = None
+    st.session_state["last_mcp_response"] = None
+    st.session_state["selected_tool"] = None
+
+def debug_log(msg):
+    st.session_state.setdefault("debug_msgs", deque(maxlen=DEBUG_MAX_MSGS))
+    st.session_state["debug_msgs"].append(msg)
+
+# =========================
+# MCP SERVER (STDIO)
+# =========================
+MCP_CMD = ["python", "mcp_server.py"]
+MCP_READY_TIMEOUT = 5.0  # seconds to wait for the startup ping reply
+MCP_REQUEST_TIMEOUT = 5.0  # seconds to wait for any other response
+MCP_POLL_INTERVAL = 1.0  # reader thread wake-up to notice a replaced process
+
+class MCPSession:
+    """
+    Owns the MCP stdio subprocess for the lifetime of the app (one instance,
+    via get_mcp_session()). ensure_started() spawns it once and waits for a
+    ping reply instead of a blind sleep; shutdown() (registered with atexit)
+    closes stdin and reaps it.
+
+    Requests are multiplexed: request() registers a Future under the request
+    id and writes under a write lock, while one reader thread parses every
+    response and resolves the Future with the matching id. Several requests
+    (from different sessions or worker threads) can be in flight at once.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.proc = None
+        self.stdin = None
+        self.lock = threading.Lock()  # start/stop
+        self._write_lock = threading.Lock()
+        self.started = False
+        self._pending = {}  # request id -> Future
+        self._req_id = itertools.count(1)  # request ids: 1, 2, 3, ...
+        atexit.register(self.shutdown)
+
+    @property
+    def pid(self):
+        return self.proc.pid if self.proc else None
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def ensure_started(self):
+        if self.started and self.alive():
+            return self
+        with self.lock:
+            if not (self.started and self.alive()):
+                self._start()
+        return self
+
+    def _start(self):
+        self.shutdown()
+        if DEBUG:
+            debug_log("[INIT] Starting MCP server (stdio)...")
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.stdin = self.proc.stdin
+        # Fresh pending map per process, so a dying reader only fails its own requests
+        self._pending = {}
+        threading.Thread(
+            target=self._reader_loop, args=(self.proc, self._pending), daemon=True
+        ).start()
+        resp = self.request("ping", timeout=MCP_READY_TIMEOUT)
+        self.started = bool((resp.get("result") or {}).get("ok"))
+        if DEBUG:
+            debug_log("[INIT] MCP server ready." if self.started
+                      else f"[INIT] MCP server did not answer ping: {resp.get('error')}")
+
+    def _send(self, obj):
+        """Write one Content-Length framed JSON message."""
+        body = orjson.dumps(obj)
+        self.stdin.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+
+    @staticmethod
+    def _take_frame(buf):
+        """
+        Pop one complete Content-Length framed body off the front of buf.
+        Returns None if buf does not hold a whole frame yet.
+        """
+        header_end = buf.find(b"\r\n\r\n")
+        if header_end == -1:
+            return None
+        header_end += 4
+        length = None
+        for line in bytes(buf[:header_end]).split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        if length is None:
+            raise ValueError("missing Content-Length header")
+        if len(buf) < header_end + length:
+            return None
+        body = bytes(buf[header_end:header_end + length])
+        del buf[:header_end + length]
+        return body
+
+    def _reader_loop(self, proc, pending):
+        """
+        Route every response to the Future waiting on its id until EOF.
+        On POSIX the pipe is non-blocking and polled through a selector, so the
+        thread also exits once its process has been replaced; Windows pipes
+        are not selectable and fall back to blocking reads.
+        """
+        fd, buf = proc.stdout.fileno(), bytearray()
+        sel = None
+        if os.name != "nt":
+            os.set_blocking(fd, False)
+            sel = selectors.DefaultSelector()
+            sel.register(fd, selectors.EVENT_READ)
+        try:
+            while self.proc is proc:
+                if sel is not None and not sel.select(timeout=MCP_POLL_INTERVAL):
+                    continue
+                try:
+                    chunk = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    break
+                buf += chunk
+                while (body := self._take_frame(buf)) is not None:
+                    try:
+                        resp = orjson.loads(body)
+                    except Exception:
+                        continue  # not attributable to any request id
+                    fut = pending.pop(resp.get("id"), None)
+                    if fut is not None:
+                        fut.set_result(resp)
+        except Exception:
+            pass
+        finally:
+            if sel is not None:
+                sel.close()
+        # Server gone (or stream corrupt): restart on next use, fail waiters
+        if self.proc is proc:
+            self.started = False
+        for rid in list(pending):
+            fut = pending.pop(rid, None)
+            if fut is not None and not fut.done():
+                fut.set_result({"error": "No response from MCP server"})
+
+    def request(self, method, params=None, timeout=MCP_REQUEST_TIMEOUT) -> dict:
+        """Send one framed request and wait for the response with the same id."""
+        if not self.alive():
+            return {"error": "MCP server not running"}
+        rid = next(self._req_id)
+        pending = self._pending
+        fut = pending[rid] = Future()
+        try:
+            with self._write_lock:
+                self._send({"id": rid, "method": method, "params": params or {}})
+        except Exception as e:
+            pending.pop(rid, None)
+            return {"error": f"failed to write to MCP stdin: {e}"}
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            pending.pop(rid, None)
+            # A hung server would stall every later call: have the next
+            # ensure_started() kill and respawn it.
+            self.started = False
+            return {"error": f"MCP timeout after {timeout:g}s ({method})"}
+
+    def shutdown(self):
+        proc, self.proc, self.started = self.proc, None, False
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.stdin.close()  # EOF ends the server's stdin loop
+            proc.wait(timeout=2)
+        except Exception:
+            proc.kill()
+
+
+@st.cache_resource
+def get_mcp_session() -> MCPSession:
+    """One MCP subprocess per app process, shared by every browser session."""
+    return MCPSession(MCP_CMD)
+
+def call_mcp(method, params=None):
+    """Send one request over the MCP session and record the response for debugging."""
+    if DEBUG:
+        debug_log(f"[MCP] -> {method} {params}")
+    resp = get_mcp_session().request(method, params)
+    if DEBUG and not resp.get("error"):
+        debug_log(f"[MCP] <- {resp}")
+    st.session_state["last_mcp_response"] = resp
+    return resp
+
+# =========================
+# TOOL DISCOVERY (RUNTIME)
+# =========================
+def list_tools_params() -> dict:
+    """Conditional list_tools: send the last etag so the server can answer 'unchanged'."""
+    etag = st.session_state.get("tools_etag")
+    if etag and st.session_state.get("tools") is not None:
+        return {"if_none_match": etag}
+    return {}
+
+def parse_tools(resp: dict) -> dict:
+    """Turn a list_tools response into {name: {description, params_schema, required}}."""
+    if resp.get("error"):
+        st.error(f"Failed to fetch tools: {resp['error']}")
+        st.session_state.pop("tools_etag", None)  # the {} below matches no etag
+        return {}
+    result = resp.get("result") or {}
+    if result.get("unchanged"):
+        # Same catalog: keep the existing dict (and the prompt memoized on it)
+        if DEBUG:
+            debug_log(f"[DISCOVERY] Tools unchanged (etag {result.get('etag')})")
+        return st.session_state.tools
+    st.session_state["tools_etag"] = result.get("etag")
+    tools = result.get("tools", [])
+    out = {}
+    for t in tools:
+        out[t["name"]] = {
+            "description": t.get("description", ""),
+            "params_schema": t.get("params_schema", {}),
+            "required": t.get("required", []),
+        }
+    if DEBUG:
+        debug_log(f"[DISCOVERY] Tools available: {list(out.keys())}")
+    return out
+
+def fetch_tools():
+    """Ask server which tools exist + their simple schemas."""
+    return parse_tools(call_mcp("list_tools", list_tools_params()))
+
+async def fetch_tools_async():
+    """fetch_tools() with the blocking stdio round-trip moved to a worker thread."""
+    params = list_tools_params()
+    if DEBUG:
+        debug_log(f"[MCP] -> list_tools {params}")
+    resp = await asyncio.to_thread(get_mcp_session().request, "list_tools", params)
+    st.session_state["last_mcp_response"] = resp
+    return parse_tools(resp)
+
+TOOLS_TTL = float(os.getenv("MCP_TOOLS_TTL", "30"))  # seconds
+
+def get_tools_cached(force: bool = False):
+    """
+    Return the tool catalog, refetching only when the cache is older than
+    TOOLS_TTL, the MCP process changed, or force=True (Refresh Tools).
+    """
+    if not force and tools_cache_fresh():
+        return st.session_state["_tools_cache"]["tools"]
+    return store_tools_cache(fetch_tools())
+
+def tools_cache_fresh() -> bool:
+    cache = st.session_state.get("_tools_cache")
+    return bool(
+        cache
+        and cache["pid"] == get_mcp_session().pid
+        and time.monotonic() - cache["ts"] < TOOLS_TTL
+    )
+
+def store_tools_cache(tools: dict) -> dict:
+    st.session_state["_tools_cache"] = {"tools": tools, "ts": time.monotonic(), "pid": get_mcp_session().pid}
+    return tools
+
+def has_tool(name: str) -> bool:
+    return name in st.session_state.tools
+
+# =========================
+# LLM ROUTER (GENERIC)
+# =========================
+@st.cache_data(max_entries=4, show_spinner=False)
+def _build_system_prompt(tools_json_key: str) -> str:
+    """Router system prompt for a canonical JSON dump of the tool list."""
+    return (
+        "You are a router. You must choose exactly one tool from the provided list.\n"
+        "Return ONLY valid JSON with keys: tool (string) and params (object).\n"
+        "If nothing matches, set tool to 'unknown' and params to {}.\n"
+        "TOOLS:\n" + tools_json_key
+    )
+
+def router_system_prompt(tools_catalog: dict) -> str:
+    """
+    Serialize the catalog only when it changes (a refresh replaces the dict),
+    keeping the built prompt in st.session_state["_tools_prompt"].
+    """
+    cached = st.session_state.get("_tools_prompt")
+    if cached and cached[0] is tools_catalog:
+        return cached[1]
+    # Routing only needs names/descriptions; field names (not full schemas)
+    # let the LLM suggest params. build_param_form reads the full schema.
+    tool_list = [
+        {
+            "name": name,
+            "description": data["description"],
+            "required": data["required"],
+            "params": list(data["params_schema"]),
+        }
+        for name, data in sorted(tools_catalog.items())
+    ]
+    prompt = _build_system_prompt(orjson.dumps(tool_list, option=orjson.OPT_SORT_KEYS).decode("utf-8"))
+    st.session_state["_tools_prompt"] = (tools_catalog, prompt)
+    return prompt
+
+class _JsonObjectScanner:
+    """
+    Incremental finder for the first balanced {...} span in streamed text.
+    feed() only scans the new chunk, carrying depth/string/escape state over,
+    so every character is examined once however the text is split. Braces
+    inside string literals (including escaped quotes) are ignored.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.depth = 0
+        self.start = -1
+        self.in_string = self.escape = False
+        self.result = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Add a chunk; return the first object once it has closed, else None."""
+        offset = self.length
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        if self.result is not None:
+            return self.result
+        for i, ch in enumerate(chunk, offset):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.depth:
+                    self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.result = self.text[self.start:i + 1]
+                    return self.result
+        return None
+
+def _first_json_object(s: str) -> Optional[str]:
+    """Return the first balanced {...} span in s, or None if none has closed."""
+    return _JsonObjectScanner().feed(s)
+
+def parse_route(content: str) -> dict:
+    """
+    Parse the router's reply into {"tool": ..., "params": {...}}. JSON mode
+    should give a bare object; if the reply still carries surrounding text,
+    fall back to the first complete object in it.
+    """
+    try:
+        parsed = orjson.loads(content)
+    except Exception:
+        obj = _first_json_object(content)
+        try:
+            parsed = orjson.loads(obj) if obj else None
+        except Exception:
+            parsed = None
+    return parsed if isinstance(parsed, dict) else {"tool":"unknown","params":{}}
+
+class RouteCache:
+    """
+    Process-wide LRU of (normalized query, tools etag) -> route JSON. Values
+    are stored serialized so callers never share a mutable dict. A new etag
+    yields new keys, so stale routes simply age out.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[dict]:
+        with self._lock:
+            raw = self._data.get(key)
+            if raw is None:
+                return None
+            self._data.move_to_end(key)
+        return orjson.loads(raw)
+
+    def put(self, key, route: dict):
+        with self._lock:
+            self._data[key] = orjson.dumps(route)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+@st.cache_resource
+def get_route_cache() -> RouteCache:
+    return RouteCache(maxsize=256)
+
+def route_cache_key(user_text: str) -> tuple:
+    """
+    RouteCache key: whitespace-collapsed text plus the catalog etag. Case is
+    kept because the cached params copy names, emails and IDs verbatim.
+    """
+    return (" ".join(user_text.split()), st.session_state.get("tools_etag"))
+
+async def route_with_llm(user_text: str, tools_catalog: dict) -> dict:
+    """
+    Ask LLM to pick ONE tool from the discovered list and propose params.
+    Output MUST be JSON like: {"tool":"add_user","params":{"name":"..."}}
+    Repeated queries against the same tool catalog are served from RouteCache.
+    """
+    cache_key = route_cache_key(user_text)
+    parsed = get_route_cache().get(cache_key)
+    if parsed is not None:
+        if DEBUG:
+            debug_log(f"[ROUTER] cache hit -> {parsed}")
+        _track_route(None, parsed)
+        return parsed
+
+    system = router_system_prompt(tools_catalog)
+    user = f"User request:\n{user_text}"
+
+    # Stream the reply and stop as soon as the JSON object closes, so the user
+    # waits for time-to-first-token plus the object, not trailing prose.
+    status = st.status("Routing…", expanded=False)
+    scanner = _JsonObjectScanner()
+    stream = get_llm().astream([SystemMessage(content=system), HumanMessage(content=user)])
+    try:
+        async for chunk in stream:
+            found = scanner.feed(chunk.content or "")
+            status.update(label=f"Routing… ({scanner.length} chars)")
+            if found is not None:
+                break
+    finally:
+        await stream.aclose()
+    content = scanner.text.strip()
+    parsed = parse_route(content)
+    status.update(label=f"Routed → {parsed.get('tool')}", state="complete")
+    if parsed.get("tool") != "unknown":
+        get_route_cache().put(cache_key, parsed)
+
+    _track_route(content, parsed)
+    return parsed
+
+def _track_route(raw, parsed: dict):
+    """Debug and tracking state for the route just chosen."""
+    st.session_state["last_llm_route"] = {"raw": raw, "parsed": parsed}
+    st.session_state["llm_selected_tool"] = parsed.get("tool")
+    # Reset invoked tool for this new query until something actually runs
+    st.session_state["invoked_tool"] = parsed.get("tool")
+
+async def route_many(texts: list, tools_catalog: dict) -> list:
+    """
+    Route several queries in one llm.abatch call that shares a single system
+    prompt. Used to replay recent queries after a tool refresh (which also
+    warms RouteCache for the new catalog); unlike route_with_llm it leaves the
+    debug/tracking state alone.
+    """
+    system = SystemMessage(content=router_system_prompt(tools_catalog))
+    resps = await get_llm().abatch(
+        [[system, HumanMessage(content=f"User request:\n{t}")] for t in texts]
+    )
+    routes = [parse_route(r.content.strip()) for r in resps]
+    for text, route in zip(texts, routes):
+        if route.get("tool") != "unknown":
+            get_route_cache().put(route_cache_key(text), route)
+    return routes
+
+async def route_and_refresh(user_text: str) -> dict:
+    """
+    Route the query and, if the tool cache is stale, refresh it concurrently so
+    the list_tools round-trip hides behind the LLM call. The route uses the
+    catalog already in session state; the refreshed one applies from here on.
+    """
+    if tools_cache_fresh():
+        return await route_with_llm(user_text, st.session_state.tools)
+    tools, route = await asyncio.gather(
+        fetch_tools_async(),
+        route_with_llm(user_text, st.session_state.tools),
+    )
+    st.session_state.tools = store_tools_cache(tools)
+    return route
+
+# =========================
+# HEURISTIC PRE-ROUTER
+# =========================
+# verb pattern -> tool; only used when exactly one pattern matches
+HEURISTIC_VERBS = [
+    (re.compile(r"\b(show|list|view|display|get)\b", re.I), "list_users"),
+    (re.compile(r"\b(add|create)\b", re.I), "add_user"),
+    (re.compile(r"\b(update|edit|change|modify)\b", re.I), "update_user"),
+    (re.compile(r"\b(delete|remove)\b", re.I), "delete_user"),
+]
+HEURISTIC_ID_RE = re.compile(r"\b(?:\bid\b\s*[:#]?\s*(\w+)|(U\d+))\b", re.I)
+HEURISTIC_FILLER = {"a", "an", "the", "me", "all", "please", "new", "user", "users", "id", "of"}
+
+def heuristic_route(text: str, tools: dict) -> Optional[dict]:
+    """
+    Route obvious requests ("show users", "delete user U010") without the LLM.
+    Returns None (fall back to the LLM) unless a single verb matches and the
+    rest of the text is filler words or a user id.
+    """
+    hits = [tool for pattern, tool in HEURISTIC_VERBS if pattern.search(text)]
+    if len(hits) != 1:
+        return None
+    tool = hits[0]
+
+    params = {}
+    m = HEURISTIC_ID_RE.search(text)
+    if m:
+        # Server IDs are uppercase and the primary-key lookup is case-sensitive
+        params["id"] = (m.group(1) or m.group(2)).upper()
+        text = text[:m.start()] + text[m.end():]
+        if tool == "list_users":
+            tool = "get_user"
+    elif tool in ("update_user", "delete_user"):
+        return None
+
+    words = re.findall(r"\w+", text.lower())
+    leftover = [w for w in words if w not in HEURISTIC_FILLER]
+    if len(leftover) != 1 or tool not in tools:
+        return None
+    return {"tool": tool, "params": params}
+
+QUERY_HISTORY_MAX = 10  # LLM-routed queries kept for replay after a tool refresh
+
+def route_query(user_text: str) -> dict:
+    """
+    Try the heuristic router first; only call the LLM when it has no answer.
+    The heuristic runs on the catalog in session state, so a stale cache is
+    refreshed either behind the LLM call (route_and_refresh) or, for a
+    heuristic hit, just before confirming the tool still exists.
+    """
+    route = heuristic_route(user_text, st.session_state.tools)
+    if route is not None and not tools_cache_fresh():
+        st.session_state.tools = get_tools_cached()
+        if route["tool"] not in st.session_state.tools:
+            route = None
+    if route is None:
+        history = st.session_state.setdefault("query_history", [])
+        history.append(user_text)
+        del history[:-QUERY_HISTORY_MAX]
+        return asyncio.run(route_and_refresh(user_text))
+    if DEBUG:
+        debug_log(f"[ROUTER] heuristic -> {route}")
+    _track_route(None, route)
+    return route
+
+# =========================
+# SCHEMA → WIDGETS (GENERIC)
+# =========================
+def _parse_json_param(raw: str):
+    """
+    Value for an array/object field typed as JSON text: "" when blank (dropped
+    on submit), the raw text if it doesn't parse (the server reports it).
+    """
+    try:
+        return orjson.loads(raw) if raw.strip() else ""
+    except orjson.JSONDecodeError:
+        return raw
+
+def _make_factory(field_name: str, spec: dict):
+    """
+    Resolve a simple schema spec once and return f(default_val) -> widget value.
+    Supported: type: string|number|integer|boolean|array|object, enum, description
+    """
+    label = f"{field_name} ({spec.get('type','string')})"
+    if spec.get("description"):
+        label += f" — {spec['description']}"
+    ftype = (spec.get("type") or "string").lower()
+    enum = spec.get("enum")
+
+    key = f"fld_{field_name}"
+
+    if enum and isinstance(enum, list) and len(enum) > 0:
+        def selectbox(default_val):
+            idx = enum.index(default_val) if default_val in enum else 0
+            return st.selectbox(label, enum, index=idx, key=key)
+        return selectbox
+
+    if ftype in ("number", "integer"):
+        def number_input(default_val):
+            try:
+                num_default = float(default_val) if default_val != "" else 0.0
+            except Exception:
+                num_default = 0.0
+            if ftype == "integer":
+                return st.number_input(label, value=int(num_default), step=1, key=key)
+            return st.number_input(label, value=float(num_default), key=key)
+        return number_input
+    elif ftype in ("array", "object"):
+        def json_area(default_val):
+            text = default_val if isinstance(default_val, str) else orjson.dumps(
+                default_val, option=orjson.OPT_INDENT_2).decode("utf-8")
+            raw = st.text_area(label + " (JSON)", value=text, key=key, height=160)
+            return _parse_json_param(raw)
+        return json_area
+    elif ftype == "boolean":
+        def checkbox(default_val):
+            bool_default = str(default_val).lower() in ("true", "1", "yes")
+            return st.checkbox(label, value=bool_default, key=key)
+        return checkbox
+    elif field_name.lower() in ("body", "message", "description"):
+        return lambda default_val: st.text_area(label, value=str(default_val), key=key, height=120)
+    return lambda default_val: st.text_input(label, value=str(default_val), key=key)
+
+def widget_factories(tool_name: str, schema_def: dict) -> list:
+    """
+    [(field, factory), ...] for a tool, built on first render and kept in
+    st.session_state["_factories"] until the tool's schema dict changes.
+    """
+    cache = st.session_state.setdefault("_factories", {})
+    cached = cache.get(tool_name)
+    if cached is None or cached[0] is not schema_def:
+        factories = [(name, _make_factory(name, spec)) for name, spec in schema_def.items()]
+        cached = cache[tool_name] = (schema_def, factories)
+    return cached[1]
+
+WIDE_FORM_FIELDS = 5  # above this, render one data_editor row instead of N widgets
+
+def _editor_column(field_name: str, spec: dict):
+    """
+    st.column_config entry plus converters for one schema field:
+    suggested value -> cell, and edited cell -> param value.
+    """
+    label = f"{field_name} ({spec.get('type','string')})"
+    help_text = spec.get("description") or None
+    ftype = (spec.get("type") or "string").lower()
+    enum = spec.get("enum")
+    if enum and isinstance(enum, list) and len(enum) > 0:
+        return (st.column_config.SelectboxColumn(label, options=enum, help=help_text),
+                lambda v: v if v in enum else None, None)
+    if ftype in ("number", "integer"):
+        def to_num(v):
+            try:
+                return (int if ftype == "integer" else float)(float(v))
+            except Exception:
+                return None
+        step = 1 if ftype == "integer" else None
+        return st.column_config.NumberColumn(label, help=help_text, step=step), to_num, None
+    if ftype == "boolean":
+        return (st.column_config.CheckboxColumn(label, help=help_text),
+                lambda v: str(v).lower() in ("true", "1", "yes"), None)
+    if ftype in ("array", "object"):
+        def to_json(v):
+            return v if isinstance(v, str) else orjson.dumps(v).decode("utf-8")
+        return (st.column_config.TextColumn(label + " (JSON)", help=help_text),
+                to_json, _parse_json_param)
+    return st.column_config.TextColumn(label, help=help_text), lambda v: str(v), None
+
+def _editor_values(tool_name: str, schema_def: dict, suggested: dict) -> dict:
+    """Render the parameters as a single-row st.data_editor; return the edited row."""
+    column_config, row, parsers = {}, {}, {}
+    for field, spec in schema_def.items():
+        column_config[field], convert, parsers[field] = _editor_column(field, spec)
+        row[field] = convert(suggested[field]) if field in suggested else None
+    edited = st.data_editor(
+        pd.DataFrame([row]),
+        column_config=column_config,
+        hide_index=True,
+        num_rows="fixed",
+        key=f"{tool_name}_editor",
+    )
+    values = {}
+    for field, v in edited.iloc[0].items():
+        if v is None or (isinstance(v, float) and v != v):  # empty cell / NaN
+            continue
+        v = v.item() if hasattr(v, "item") else v
+        values[field] = parsers[field](v) if parsers[field] else v
+    return values
+
+def build_param_form(tool_name: str, tool_schema: dict, suggested: dict):
+    """
+    Render a form for any tool based on its params_schema + required.
+    Tools with more than WIDE_FORM_FIELDS fields get one data_editor row.
+    Returns (submitted: bool, params: dict)
+    """
+    required = tool_schema.get("required", [])
+    schema_def = tool_schema.get("params_schema", {})
+
+    with st.form(key=f"{tool_name}_form"):
+        st.markdown(f"#### {tool_name} — Parameters")
+        if len(schema_def) > WIDE_FORM_FIELDS:
+            values = _editor_values(tool_name, schema_def, suggested)
+        else:
+            values = {}
+            for field, factory in widget_factories(tool_name, schema_def):
+                values[field] = factory(suggested.get(field, ""))
+        if required:
+            st.caption(f"Required: {', '.join(required)}")
+        pretty_name = tool_name.replace("_", " ").title()
+        submitted = st.form_submit_button(pretty_name)
+
+
+    if submitted:
+        clean = {}
+        for k, v in values.items():
+            if isinstance(v, str):
+                if v != "":
+                    clean[k] = v
+            else:
+                clean[k] = v
+        return True, clean
+    return False, {}
+
+# =========================
+# GENERIC RESULT RENDERING
+# =========================
+@st.cache_data(ttl=60, show_spinner=False)
+def to_df(payload_tuple: tuple) -> pd.DataFrame:
+    """Build a DataFrame from rows given as tuples of (key, value) pairs."""
+    return pd.DataFrame([dict(row) for row in payload_tuple])
+
+def rows_to_df(rows: list) -> pd.DataFrame:
+    """
+    DataFrame for a list-of-dicts result, reusing the last one rendered
+    (st.session_state["last_df"]) or the cached to_df() when rows are unchanged.
+    """
+    try:
+        key = tuple(tuple(d.items()) for d in rows)
+        hash(key)
+    except TypeError:  # nested/unhashable values: build directly
+        return pd.DataFrame(rows)
+    last = st.session_state.get("last_df")
+    if last is not None and last[0] == key:
+        return last[1]
+    df = to_df(key)
+    st.session_state["last_df"] = (key, df)
+    return df
+
+def render_result(resp: dict):
+    if resp.get("error"):
+        st.error(resp["error"])
+        return
+
+    result = resp.get("result", None)
+    if result is None:
+        st.json(resp)
+        return
+
+    # Direct list case
+    if isinstance(result, list) and result and isinstance(result[0], dict):
+        st.dataframe(rows_to_df(result), use_container_width=True)
+        return
+
+    # Dict cases
+    if isinstance(result, dict):
+        # list-of-dicts under a single key
+        for key, val in result.items():
+            if isinstance(val, list) and val and isinstance(val[0], dict):
+                st.dataframe(rows_to_df(val), use_container_width=True)
+                return
+            if isinstance(val, dict):
+                st.table(pd.DataFrame([val]))
+                return
+        # flat dict
+        try:
+            st.table(pd.DataFrame([result]))
+            return
+        except Exception:
+            pass
+
+    st.json(resp)
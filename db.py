@@ -1,12 +1,16 @@
 from __future__ import annotations
 import sqlite3
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import os
+import time
 import uuid
 from datetime import datetime
 
 DB_PATH = Path("users.db")
 
+# Table only: shared with mcp_server.py (which stores short IDs like U001 in
+# the TEXT id). Indexes are per-store, since each serves its own queries.
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS gcp_users (
     id TEXT PRIMARY KEY,
@@ -16,37 +20,90 @@ CREATE TABLE IF NOT EXISTS gcp_users (
     created_at TEXT NOT NULL
 );
 """
+# Serves list_users' ORDER BY created_at here; the server sorts by short ID
+SQL_INDEX_CREATED_AT = "CREATE INDEX IF NOT EXISTS idx_gcp_users_created_at ON gcp_users(created_at DESC)"
+
+# WAL + synchronous=NORMAL avoid an fsync'd rollback journal on every write
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+USER_KEYS = ("id", "name", "email", "role", "created_at")
+
+
+def open_db(path, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect(path, **kwargs) with the shared PRAGMAS applied."""
+    conn = sqlite3.connect(path, **kwargs)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(SCHEMA)
+
+
+_schema_ready = False
+
 
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    global _schema_ready
+    conn = open_db(DB_PATH)
     conn.row_factory = sqlite3.Row
+    # Created on first use rather than at import, so importing this module
+    # (as mcp_server.py does) doesn't create users.db as a side effect.
+    if not _schema_ready:
+        ensure_schema(conn)
+        conn.execute(SQL_INDEX_CREATED_AT)
+        _schema_ready = True
     return conn
 
-# Ensure table exists
-with get_conn() as conn:
-    conn.execute(SCHEMA)
-    conn.commit()
+
+def new_user_id() -> str:
+    """
+    Time-ordered UUIDv7 (RFC 9562), so new rows append at the right edge of
+    the primary-key B-tree instead of landing at random pages like UUID4.
+    """
+    if hasattr(uuid, "uuid7"):  # Python 3.14+
+        return str(uuid.uuid7())
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    rand_a, rand_b = rand >> 68, rand & ((1 << 62) - 1)
+    value = (ms & ((1 << 48) - 1)) << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b
+    return str(uuid.UUID(int=value))
 
 
 def add_user(name: str, email: str, role: str) -> Dict[str, Any]:
-    user_id = str(uuid.uuid4())
+    user_id = new_user_id()
+    name, email, role = name.strip(), email.strip().lower(), role.strip()
     created_at = datetime.utcnow().isoformat()
     with get_conn() as conn:
         conn.execute(
             "INSERT INTO gcp_users (id, name, email, role, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, name.strip(), email.strip().lower(), role.strip()),
+            (user_id, name, email, role, created_at),
         )
         conn.commit()
     return {
         "id": user_id,
         "name": name,
-        "email": email.strip().lower(),
+        "email": email,
         "role": role,
         "created_at": created_at,
     }
 
 
-def list_users() -> List[Dict[str, Any]]:
+def list_users(limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    # ISO-8601 strings sort correctly as text, so the created_at index serves
+    # the ORDER BY directly (datetime(created_at) would force a full sort).
     with get_conn() as conn:
-        rows = conn.execute("SELECT id, name, email, role, created_at FROM gcp_users ORDER BY datetime(created_at) DESC").fetchall()
-    return [dict(r) for r in rows]
+        cur = conn.cursor()
+        cur.row_factory = None  # plain tuples; skip building a sqlite3.Row per row
+        rows = cur.execute(
+            "SELECT id, name, email, role, created_at FROM gcp_users ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        ).fetchall()
+    return [dict(zip(USER_KEYS, r)) for r in rows]
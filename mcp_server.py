@@ -1,60 +1,301 @@
 # mcp_server.py
 import sys
 import json
+import orjson
+import hashlib
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from db import USER_KEYS, ensure_schema, open_db
 
 DB = "gcp_users.db"
 
+# Connections live for the whole process (opened by init_db) instead of a
+# connect/close per request. SQLite allows one writer at a time, so all writes
+# go through _WRITER under _LOCK; reads borrow a read-only connection from
+# _READERS and, with WAL, never wait on the writer. main_loop is
+# single-threaded today, but the split lets reads be dispatched concurrently.
+_WRITER = None
+_LOCK = threading.Lock()
+READER_POOL_SIZE = 4
+_READERS = queue.Queue()
+
+# Open client transactions (begin/commit RPCs). 0 = autocommit; the first
+# begin is BEGIN IMMEDIATE, deeper ones are SAVEPOINT sp_<depth>.
+_tx_depth = 0
+
+# -----------------------------
+# SQL (fixed text, so sqlite3's statement cache reuses the prepared plans)
+# -----------------------------
+SQL_MAX_USER_NUM = """
+    SELECT MAX(CAST(substr(id, 2) AS INTEGER))
+    FROM gcp_users
+    WHERE id GLOB 'U[0-9]*'
+"""
+SQL_INSERT_USER = "INSERT INTO gcp_users (id, name, email, role, created_at) VALUES (?, ?, ?, ?, ?)"
+# Numeric part of the short ID. The expression index below stores it, so
+# ORDER BY walks that index instead of scanning + sorting the whole table.
+SQL_INDEX_ID_NUM = """
+    CREATE INDEX IF NOT EXISTS idx_gcp_users_id_num
+    ON gcp_users(CAST(substr(id, 2) AS INTEGER))
+"""
+SQL_LIST_USERS = """
+    SELECT id, name, email, role, created_at
+    FROM gcp_users
+    ORDER BY CAST(substr(id, 2) AS INTEGER) ASC
+    LIMIT ? OFFSET ?
+"""
+SQL_GET_USER = "SELECT id, name, email, role, created_at FROM gcp_users WHERE id = ?"
+# Stay under SQLITE_MAX_VARIABLE_NUMBER (999 on older builds)
+SQL_MAX_IN_IDS = 500
+# NULL keeps the current value, so one statement covers every field combination
+SQL_UPDATE_USER = """
+    UPDATE gcp_users
+    SET name = COALESCE(?, name), email = COALESCE(?, email), role = COALESCE(?, role)
+    WHERE id = ?
+"""
+SQL_DELETE_USER = "DELETE FROM gcp_users WHERE id = ?"
+# Single-row variants: the returned row patches the known-email cache, so a
+# successful update/delete needs no extra SELECT (executemany drops RETURNING rows)
+SQL_UPDATE_USER_RETURNING = SQL_UPDATE_USER + "RETURNING id, email"
+SQL_DELETE_USER_RETURNING = SQL_DELETE_USER + " RETURNING id, email"
+SQL_ALL_EMAILS = "SELECT id, email FROM gcp_users"
+
+@lru_cache(maxsize=64)
+def sql_get_users(n: int) -> str:
+    """SELECT ... WHERE id IN (?, ?, ...) with n placeholders; one text per arity."""
+    return (
+        "SELECT id, name, email, role, created_at FROM gcp_users WHERE id IN ("
+        + ", ".join("?" * n) + ")"
+    )
+
+# -----------------------------
+# FIXED ERROR REPLIES
+# -----------------------------
+# Returned as-is (main_loop copies them into the reply, never mutates them),
+# so common validation failures skip building a fresh dict.
+_ERR_USER_FIELDS_REQUIRED = {"error": "name, email and role are required"}
+_ERR_USERS_NOT_LIST = {"error": "users must be a non-empty list of {name, email, role}"}
+_ERR_PAGE_NOT_INT = {"error": "limit and offset must be integers"}
+_ERR_PAGE_NEGATIVE = {"error": "limit and offset must not be negative"}
+_ERR_ID_REQUIRED = {"error": "id is required"}
+_ERR_IDS_NOT_LIST = {"error": "ids must be a list of short user IDs"}
+_ERR_IDS_REQUIRED = {"error": "ids is required"}
+_ERR_UPDATE_FIELDS_REQUIRED = {"error": "At least one field (name/email/role) is required to update"}
+_ERR_USER_NOT_FOUND = {"error": "No user found with this ID"}
+_ERR_UPDATES_NOT_LIST = {"error": "updates must be a non-empty list of {id, name?, email?, role?}"}
+_ERR_EMAIL_FIELDS_REQUIRED = {"error": "to, subject and body are required"}
+_ERR_NO_TRANSACTION = {"error": "No open transaction"}
+_ERR_DUPLICATE_EMAIL = {"error": "A user with this email already exists"}
+
 # -----------------------------
 # DB INIT
 # -----------------------------
 def init_db():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    # TEXT id so we can store short IDs like U001
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS gcp_users (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        role TEXT NOT NULL,
-        created_at TEXT NOT NULL
+    global _WRITER
+    # isolation_level=None: no implicit BEGIN before DML; single statements
+    # autocommit and grouped writes use transaction() / the begin RPC.
+    # PRAGMAs (WAL, synchronous=NORMAL, ...) and the table schema come from db.py
+    _WRITER = open_db(
+        DB, check_same_thread=False, cached_statements=256, isolation_level=None
     )
-    """)
-    conn.commit()
-    conn.close()
+    ensure_schema(_WRITER)
+    cur = _WRITER.cursor()
+    cur.execute(SQL_INDEX_ID_NUM)
+    load_id_counter(cur)
+    load_known_emails(cur)
+
+    # After the writer: the file must exist and already be in WAL mode
+    ro_uri = Path(DB).resolve().as_uri() + "?mode=ro"
+    for _ in range(READER_POOL_SIZE):
+        _READERS.put(open_db(ro_uri, uri=True, check_same_thread=False, cached_statements=256))
+
+def close_db():
+    """
+    Close the readers first: the last connection to close checkpoints and
+    removes the -wal/-shm files, which a read-only connection can't do.
+    """
+    while not _READERS.empty():
+        _READERS.get_nowait().close()
+    _WRITER.close()
+
+@contextmanager
+def reader():
+    """
+    Borrow a read-only connection. Inside a client transaction, reads use the
+    writer instead so they see the transaction's own uncommitted rows.
+    """
+    if _tx_depth:
+        with _LOCK:
+            yield _WRITER
+        return
+    conn = _READERS.get()
+    try:
+        yield conn
+    finally:
+        _READERS.put(conn)
+
+# -----------------------------
+# STDIO FRAMING (Content-Length, LSP style)
+# -----------------------------
+def read_request(stdin):
+    """
+    Read one 'Content-Length: N' framed message from binary stdin.
+    Returns the body bytes, or None at EOF.
+    """
+    length = None
+    while True:
+        line = stdin.readline()
+        if not line:
+            return None
+        if line in (b"\r\n", b"\n"):
+            if length is not None:
+                break
+            continue
+        # Exact-case fast path avoids allocating; int() ignores the
+        # surrounding whitespace and CRLF, so no strip() is needed either.
+        name, _, value = line.partition(b":")
+        if name == b"Content-Length" or name.lower() == b"content-length":
+            length = int(value)
+    return stdin.read(length)
 
 def send_response(resp_obj):
-    sys.stdout.write(json.dumps(resp_obj, ensure_ascii=False) + "\n")
-    sys.stdout.flush()
+    # orjson encodes straight to UTF-8 bytes (no ensure_ascii escaping, no str->bytes pass)
+    send_frame(orjson.dumps(resp_obj))
+
+def send_frame(body: bytes):
+    out = sys.stdout.buffer
+    out.write(b"Content-Length: %d\r\n\r\n" % len(body))
+    out.write(body)
+    out.flush()
 
 # -----------------------------
-# ID GENERATION: U001, U002, ...
+# TRANSACTIONS
 # -----------------------------
-def next_user_id(cur) -> str:
+@contextmanager
+def transaction():
     """
-    Find the maximum numeric part of IDs that look like 'U<digits>'
-    and return the next one, zero-padded to 3 digits (U001, U002, ...).
-    If none found, start at U001.
+    Make a multi-statement write atomic. Outside a client transaction this is
+    BEGIN IMMEDIATE ... COMMIT; inside one it is a savepoint, so a failed batch
+    rolls back only itself and the client's transaction stays open.
+    Caller holds _LOCK.
     """
-    cur.execute("""
-        SELECT id
-        FROM gcp_users
-        WHERE id GLOB 'U[0-9]*'
-        ORDER BY CAST(substr(id, 2) AS INTEGER) DESC
-        LIMIT 1
-    """)
-    row = cur.fetchone()
-    if not row:
-        return "U001"
-    last_id = row[0]  # e.g. "U007"
-    try:
-        n = int(last_id[1:]) + 1
-    except Exception:
-        n = 1
+    if _tx_depth == 0:
+        _WRITER.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            _WRITER.execute("ROLLBACK")
+            raise
+        _WRITER.execute("COMMIT")
+    else:
+        _WRITER.execute("SAVEPOINT batch")
+        try:
+            yield
+        except BaseException:
+            _WRITER.execute("ROLLBACK TO batch")
+            _WRITER.execute("RELEASE batch")
+            raise
+        _WRITER.execute("RELEASE batch")
+
+# -----------------------------
+# ID GENERATION: U001, U002, ...
+# -----------------------------
+# Highest numeric part of any 'U<digits>' id. Seeded once from the table by
+# init_db(); inserts then take n+1 without querying the table.
+_next_id_counter = 0
+
+def load_id_counter(cur):
+    """(Re)seed _next_id_counter with MAX over existing 'U<digits>' ids."""
+    global _next_id_counter
+    cur.execute(SQL_MAX_USER_NUM)
+    _next_id_counter = cur.fetchone()[0] or 0
+
+def format_user_id(n: int) -> str:
+    """Zero-padded short ID: 1 -> U001."""
     return f"U{n:03d}"
 
+# -----------------------------
+# KNOWN EMAILS (duplicate preflight)
+# -----------------------------
+# Mirror of the UNIQUE email column, so a duplicate is rejected without an
+# INSERT/UPDATE round trip. Kept both ways (email -> id, id -> email) so an
+# update or delete finds the email it frees without querying. Updated after
+# each successful write; the UNIQUE constraint stays the source of truth if
+# the two ever drift.
+_known_emails = {}
+_user_emails = {}
+
+def load_known_emails(cur):
+    """(Re)load _known_emails / _user_emails from the table."""
+    global _known_emails, _user_emails
+    _user_emails = dict(cur.execute(SQL_ALL_EMAILS))
+    _known_emails = {email: uid for uid, email in _user_emails.items()}
+
+def note_email(user_id, email):
+    """Record user_id's current email, freeing the one it replaces."""
+    old = _user_emails.get(user_id)
+    if old != email:
+        if old is not None:
+            _known_emails.pop(old, None)
+        _user_emails[user_id] = email
+        _known_emails[email] = user_id
+
+def drop_email(user_id):
+    """Forget a deleted user's email."""
+    email = _user_emails.pop(user_id, None)
+    if email is not None:
+        _known_emails.pop(email, None)
+
+def resync_caches():
+    """Reload the ID counter and known emails from the table. Caller holds _LOCK."""
+    cur = _WRITER.cursor()
+    load_id_counter(cur)
+    load_known_emails(cur)
+
+# -----------------------------
+# TIMESTAMPS
+# -----------------------------
+# (second, "YYYY-MM-DDTHH:MM:SS") of the last call; strftime only runs when
+# the second rolls over, otherwise just the microseconds are formatted.
+_ts_cache = (None, "")
+
+def utc_timestamp() -> str:
+    """ISO-8601 UTC with microseconds, e.g. 2025-08-27T12:26:37.577055Z."""
+    global _ts_cache
+    sec, usec = divmod(time.time_ns() // 1000, 1_000_000)
+    if _ts_cache[0] != sec:
+        _ts_cache = (sec, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec)))
+    return f"{_ts_cache[1]}.{usec:06d}Z"
+
+# -----------------------------
+# PARAM HELPERS
+# -----------------------------
+def _str_fields(entry, keys):
+    """
+    Stripped string values of `keys` in a batch entry ("" when missing), or
+    None if any present value isn't a string (JSON lets clients send anything).
+    """
+    values = []
+    for k in keys:
+        v = entry.get(k)
+        if v is None:
+            v = ""
+        elif not isinstance(v, str):
+            return None
+        values.append(v.strip())
+    return values
+
+def _clean_ids(ids):
+    """Stripped, non-empty, de-duplicated string ids in request order."""
+    cleaned = (i.strip() for i in ids if isinstance(i, str))
+    return list(dict.fromkeys(i for i in cleaned if i))
+
 # -----------------------------
 # HANDLERS
 # -----------------------------
@@ -63,28 +304,30 @@ def handle_add_user(params):
     email = (params.get("email") or "").strip().lower()
     role = (params.get("role") or "").strip()
     if not (name and email and role):
-        return {"error": "name, email and role are required"}
+        return _ERR_USER_FIELDS_REQUIRED
 
-    created_at = datetime.utcnow().isoformat() + "Z"
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    created_at = utc_timestamp()
 
+    global _next_id_counter
     try:
-        # Generate short ID like U001, U002...
-        user_id = next_user_id(cur)
-        cur.execute(
-            "INSERT INTO gcp_users (id, name, email, role, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, name, email, role, created_at)
-        )
-        conn.commit()
+        with _LOCK:
+            if email in _known_emails:
+                return _ERR_DUPLICATE_EMAIL
+            # Generate short ID like U001, U002...
+            n = _next_id_counter + 1
+            user_id = format_user_id(n)
+            # One statement: autocommits, or joins an open client transaction
+            _WRITER.execute(SQL_INSERT_USER, (user_id, name, email, role, created_at))
+            _next_id_counter = n
+            note_email(user_id, email)
     except sqlite3.IntegrityError as e:
-        conn.close()
+        # Resync in case the table was written outside this process
+        with _LOCK:
+            resync_caches()
         return {"error": f"DB insert error (likely duplicate email): {e}"}
     except Exception as e:
-        conn.close()
         return {"error": f"DB insert error: {e}"}
 
-    conn.close()
     return {
         "result": {
             "id": user_id,
@@ -95,97 +338,215 @@ def handle_add_user(params):
         }
     }
 
-def handle_list_users(_params):
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, name, email, role, created_at
-        FROM gcp_users
-        ORDER BY CAST(substr(id, 2) AS INTEGER) ASC
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    users = [
-        {"id": r[0], "name": r[1], "email": r[2], "role": r[3], "created_at": r[4]}
-        for r in rows
-    ]
-    return {"result": {"users": users}}
+def handle_add_users(params):
+    """
+    Insert many users in one transaction: IDs come from the cached counter,
+    then one executemany. All-or-nothing: any invalid row or duplicate email
+    rolls back the whole batch.
+    """
+    users = params.get("users")
+    if not isinstance(users, list) or not users:
+        return _ERR_USERS_NOT_LIST
+
+    created_at = utc_timestamp()
+    rows = []
+    for i, u in enumerate(users):
+        u = u if isinstance(u, dict) else {}
+        fields = _str_fields(u, ("name", "email", "role"))
+        if fields is None:
+            return {"error": f"users[{i}]: name, email and role must be strings"}
+        name, email, role = fields
+        email = email.lower()
+        if not (name and email and role):
+            return {"error": f"users[{i}]: name, email and role are required"}
+        rows.append([None, name, email, role, created_at])
+
+    emails = [row[2] for row in rows]
+    global _next_id_counter
+    try:
+        with _LOCK:
+            seen = set()
+            for i, email in enumerate(emails):
+                if email in _known_emails or email in seen:
+                    return {"error": f"users[{i}]: a user with this email already exists"}
+                seen.add(email)
+            n = _next_id_counter
+            for row in rows:
+                n += 1
+                row[0] = format_user_id(n)
+            with transaction():
+                _WRITER.executemany(SQL_INSERT_USER, rows)
+            _next_id_counter = n
+            for row in rows:
+                note_email(row[0], row[2])
+    except sqlite3.IntegrityError as e:
+        with _LOCK:
+            resync_caches()
+        return {"error": f"DB insert error (likely duplicate email): {e}"}
+    except Exception as e:
+        return {"error": f"DB insert error: {e}"}
+
+    return {"result": {"users": [dict(zip(USER_KEYS, r)) for r in rows], "count": len(rows)}}
+
+def handle_list_users(params):
+    """Users in short-ID order; optional limit/offset page through them."""
+    limit = params.get("limit")
+    offset = params.get("offset") or 0
+    try:
+        limit = -1 if limit in (None, "") else int(limit)
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return _ERR_PAGE_NOT_INT
+    if limit < -1 or offset < 0:
+        return _ERR_PAGE_NEGATIVE
+
+    with reader() as conn:
+        rows = conn.execute(SQL_LIST_USERS, (limit, offset)).fetchall()
+    return {"result": {"users": [dict(zip(USER_KEYS, r)) for r in rows]}}
 
 def handle_get_user(params):
     uid = (params.get("id") or "").strip()
     if not uid:
-        return {"error": "id is required"}
+        return _ERR_ID_REQUIRED
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, email, role, created_at FROM gcp_users WHERE id = ?", (uid,))
-    row = cur.fetchone()
-    conn.close()
+    with reader() as conn:
+        row = conn.execute(SQL_GET_USER, (uid,)).fetchone()
 
     if not row:
         # Return empty result; client can show "No user found."
         return {"result": {}}
 
-    user = {"id": row[0], "name": row[1], "email": row[2], "role": row[3], "created_at": row[4]}
-    return {"result": {"user": user}}
+    return {"result": {"user": dict(zip(USER_KEYS, row))}}
+
+def handle_get_users(params):
+    """
+    Fetch several users by short ID with IN (...) lookups on the primary key.
+    Users come back in request order; unknown IDs are listed under "missing".
+    """
+    ids = params.get("ids")
+    if not isinstance(ids, list):
+        return _ERR_IDS_NOT_LIST
+    ids = _clean_ids(ids)
+    if not ids:
+        return _ERR_IDS_REQUIRED
+
+    found = {}
+    with reader() as conn:
+        for i in range(0, len(ids), SQL_MAX_IN_IDS):
+            chunk = ids[i:i + SQL_MAX_IN_IDS]
+            for row in conn.execute(sql_get_users(len(chunk)), chunk):
+                found[row[0]] = row
+
+    users = [dict(zip(USER_KEYS, found[uid])) for uid in ids if uid in found]
+    missing = [uid for uid in ids if uid not in found]
+    return {"result": {"users": users, "missing": missing}}
 
 def handle_update_user(params):
     user_id = (params.get("id") or "").strip()
     name = (params.get("name") or "").strip()
-    email = (params.get("email") or "").strip()
+    email = (params.get("email") or "").strip().lower()
     role = (params.get("role") or "").strip()
 
     if not user_id:
-        return {"error": "id is required"}
+        return _ERR_ID_REQUIRED
     if not (name or email or role):
-        return {"error": "At least one field (name/email/role) is required to update"}
+        return _ERR_UPDATE_FIELDS_REQUIRED
+
+    # Empty -> None -> COALESCE keeps the stored value
+    values = (name or None, email or None, role or None, user_id)
 
-    fields = []
-    values = []
-    if name:
-        fields.append("name = ?")
-        values.append(name)
-    if email:
-        fields.append("email = ?")
-        values.append(email)
-    if role:
-        fields.append("role = ?")
-        values.append(role)
-    values.append(user_id)
-
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
     try:
-        cur.execute(f"UPDATE gcp_users SET {', '.join(fields)} WHERE id = ?", values)
-        conn.commit()
-        if cur.rowcount == 0:
-            return {"error": "No user found with this ID"}
+        with _LOCK:
+            # Taken by another user; keeping one's own email is fine
+            if email and _known_emails.get(email, user_id) != user_id:
+                return _ERR_DUPLICATE_EMAIL
+            row = _WRITER.execute(SQL_UPDATE_USER_RETURNING, values).fetchone()
+            if row:
+                note_email(*row)
     except sqlite3.IntegrityError as e:
-        conn.close()
+        with _LOCK:
+            resync_caches()
         return {"error": f"DB update error (likely duplicate email): {e}"}
     except Exception as e:
-        conn.close()
         return {"error": f"DB update error: {e}"}
-    conn.close()
+    if row is None:
+        return _ERR_USER_NOT_FOUND
     return {"result": {"message": "User updated successfully"}}
 
+def handle_update_users(params):
+    """
+    Apply many updates in one transaction with one executemany.
+    All-or-nothing: an invalid entry or duplicate email rolls back the batch.
+    """
+    updates = params.get("updates")
+    if not isinstance(updates, list) or not updates:
+        return _ERR_UPDATES_NOT_LIST
+
+    rows = []
+    for i, u in enumerate(updates):
+        u = u if isinstance(u, dict) else {}
+        fields = _str_fields(u, ("id", "name", "email", "role"))
+        if fields is None:
+            return {"error": f"updates[{i}]: id, name, email and role must be strings"}
+        user_id, name, email, role = fields
+        email = email.lower()
+        if not user_id:
+            return {"error": f"updates[{i}]: id is required"}
+        if not (name or email or role):
+            return {"error": f"updates[{i}]: at least one field (name/email/role) is required"}
+        rows.append((name or None, email or None, role or None, user_id))
+
+    # Entries may hand an email from one user to another, so the batch isn't
+    # preflighted; once it commits, the cache replays the rows in order
+    # (ids it doesn't know matched no row).
+    try:
+        with _LOCK:
+            with transaction():
+                cur = _WRITER.executemany(SQL_UPDATE_USER, rows)
+            for _name, email, _role, user_id in rows:
+                if email and user_id in _user_emails:
+                    note_email(user_id, email)
+    except sqlite3.IntegrityError as e:
+        with _LOCK:
+            resync_caches()
+        return {"error": f"DB update error (likely duplicate email): {e}"}
+    except Exception as e:
+        return {"error": f"DB update error: {e}"}
+    return {"result": {"message": "Users updated successfully", "updated": cur.rowcount, "requested": len(rows)}}
+
 def handle_delete_user(params):
     user_id = (params.get("id") or "").strip()
     if not user_id:
-        return {"error": "id is required"}
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+        return _ERR_ID_REQUIRED
     try:
-        cur.execute("DELETE FROM gcp_users WHERE id = ?", (user_id,))
-        conn.commit()
-        if cur.rowcount == 0:
-            return {"error": "No user found with this ID"}
+        with _LOCK:
+            row = _WRITER.execute(SQL_DELETE_USER_RETURNING, (user_id,)).fetchone()
+            if row:
+                drop_email(row[0])
     except Exception as e:
-        conn.close()
         return {"error": f"DB delete error: {e}"}
-    conn.close()
+    if row is None:
+        return _ERR_USER_NOT_FOUND
     return {"result": {"message": "User deleted successfully"}}
 
+def handle_delete_users(params):
+    """Delete many users by short ID in one transaction with one executemany."""
+    ids = params.get("ids")
+    if not isinstance(ids, list):
+        return _ERR_IDS_NOT_LIST
+    ids = _clean_ids(ids)
+    if not ids:
+        return _ERR_IDS_REQUIRED
+    try:
+        with _LOCK:
+            with transaction():
+                cur = _WRITER.executemany(SQL_DELETE_USER, [(uid,) for uid in ids])
+            for uid in ids:
+                drop_email(uid)
+    except Exception as e:
+        return {"error": f"DB delete error: {e}"}
+    return {"result": {"message": "Users deleted successfully", "deleted": cur.rowcount, "requested": len(ids)}}
+
 # -------------------------------------------------
 # Example New Tool (kept commented for live demo)
 # -------------------------------------------------
@@ -198,7 +559,7 @@ def handle_send_email(params):
     subject = (params.get("subject") or "").strip()
     body = (params.get("body") or "").strip()
     if not (to and subject and body):
-        return {"error": "to, subject and body are required"}
+        return _ERR_EMAIL_FIELDS_REQUIRED
     # Pretend email sent
     return {
         "result": {
@@ -211,66 +572,201 @@ def handle_send_email(params):
 # -----------------------------
 # TOOL DISCOVERY
 # -----------------------------
-def handle_list_tools(_params):
-    tools = [
-        {
-            "name": "add_user",
-            "description": "Add a new GCP user",
-            "required": ["name", "email", "role"],
-            "params_schema": {
-                "name":  {"type": "string", "description": "Full name"},
-                "email": {"type": "string", "description": "Email (unique)"},
-                "role":  {"type": "string", "description": "Role e.g. viewer, editor, admin"},
+TOOLS = [
+    {
+        "name": "add_user",
+        "description": "Add a new GCP user",
+        "required": ["name", "email", "role"],
+        "params_schema": {
+            "name":  {"type": "string", "description": "Full name"},
+            "email": {"type": "string", "description": "Email (unique)"},
+            "role":  {"type": "string", "description": "Role e.g. viewer, editor, admin"},
+        },
+    },
+    {
+        "name": "add_users",
+        "description": "Add several GCP users at once (single transaction)",
+        "required": ["users"],
+        "params_schema": {
+            "users": {
+                "type": "array",
+                "description": "List of {name, email, role} objects",
             },
         },
-        {
-            "name": "list_users",
-            "description": "List all users",
-            "required": [],
-            "params_schema": {},
+    },
+    {
+        "name": "list_users",
+        "description": "List all users (optionally one page at a time)",
+        "required": [],
+        "params_schema": {
+            "limit":  {"type": "integer", "description": "Max users to return (optional)"},
+            "offset": {"type": "integer", "description": "Users to skip (optional)"},
         },
-        {
-            "name": "get_user",
-            "description": "Get a single user by short ID (e.g., U001)",
-            "required": ["id"],
-            "params_schema": {
-                "id": {"type": "string", "description": "Short user ID like U001"},
-            },
+    },
+    {
+        "name": "get_user",
+        "description": "Get a single user by short ID (e.g., U001)",
+        "required": ["id"],
+        "params_schema": {
+            "id": {"type": "string", "description": "Short user ID like U001"},
         },
-        {
-            "name": "update_user",
-            "description": "Update fields for an existing user by short ID",
-            "required": ["id"],  # id required; others optional
-            "params_schema": {
-                "id":    {"type": "string", "description": "Short user ID like U001"},
-                "name":  {"type": "string", "description": "New name (optional)"},
-                "email": {"type": "string", "description": "New email (optional)"},
-                "role":  {"type": "string", "description": "New role (optional)"},
-            },
+    },
+    {
+        "name": "get_users",
+        "description": "Get several users by short ID (e.g., [\"U001\", \"U002\"])",
+        "required": ["ids"],
+        "params_schema": {
+            "ids": {"type": "array", "description": "List of short user IDs"},
         },
-        {
-            "name": "delete_user",
-            "description": "Delete user by short ID",
-            "required": ["id"],
-            "params_schema": {
-                "id": {"type": "string", "description": "Short user ID like U001"},
-            },
+    },
+    {
+        "name": "update_user",
+        "description": "Update fields for an existing user by short ID",
+        "required": ["id"],  # id required; others optional
+        "params_schema": {
+            "id":    {"type": "string", "description": "Short user ID like U001"},
+            "name":  {"type": "string", "description": "New name (optional)"},
+            "email": {"type": "string", "description": "New email (optional)"},
+            "role":  {"type": "string", "description": "New role (optional)"},
         },
-        # -------------------------------------
-        # Example new tool (uncomment to enable)
-        {
-            "name": "send_email",
-            "description": "Send an email to a user (demo)",
-            "required": ["to", "subject", "body"],
-            "params_schema": {
-                "to": {"type": "string", "description": "Recipient email"},
-                "subject": {"type": "string", "description": "Email subject"},
-                "body": {"type": "string", "description": "Email body"},
+    },
+    {
+        "name": "update_users",
+        "description": "Update several users by short ID at once (single transaction)",
+        "required": ["updates"],
+        "params_schema": {
+            "updates": {
+                "type": "array",
+                "description": "List of {id, name?, email?, role?} objects",
             },
         },
-        # -------------------------------------
-    ]
-    return {"result": {"tools": tools}}
+    },
+    {
+        "name": "delete_user",
+        "description": "Delete user by short ID",
+        "required": ["id"],
+        "params_schema": {
+            "id": {"type": "string", "description": "Short user ID like U001"},
+        },
+    },
+    {
+        "name": "delete_users",
+        "description": "Delete several users by short ID at once (single transaction)",
+        "required": ["ids"],
+        "params_schema": {
+            "ids": {"type": "array", "description": "List of short user IDs"},
+        },
+    },
+    # -------------------------------------
+    # Example new tool (uncomment to enable)
+    {
+        "name": "send_email",
+        "description": "Send an email to a user (demo)",
+        "required": ["to", "subject", "body"],
+        "params_schema": {
+            "to": {"type": "string", "description": "Recipient email"},
+            "subject": {"type": "string", "description": "Email subject"},
+            "body": {"type": "string", "description": "Email body"},
+        },
+    },
+    # -------------------------------------
+]
+TOOLS_ETAG = hashlib.sha1(
+    json.dumps(TOOLS, sort_keys=True, ensure_ascii=False).encode("utf-8")
+).hexdigest()
+
+# The catalog is static for the life of the process, so both replies are
+# serialized once. The handler returns the bytes between the outer braces and
+# main_loop splices the id/method envelope in front of them.
+_LIST_TOOLS_FULL = orjson.dumps({"result": {"tools": TOOLS, "etag": TOOLS_ETAG}})[1:-1]
+_LIST_TOOLS_UNCHANGED = orjson.dumps({"result": {"unchanged": True, "etag": TOOLS_ETAG}})[1:-1]
+
+def handle_list_tools(params):
+    """
+    Return the tool catalog plus an etag (sha1 of its canonical JSON).
+    If params.if_none_match equals the current etag, reply {"unchanged": true}
+    instead of resending the whole catalog.
+    """
+    if params.get("if_none_match") == TOOLS_ETAG:
+        return _LIST_TOOLS_UNCHANGED
+    return _LIST_TOOLS_FULL
+
+def handle_begin(_params):
+    """Open a client transaction (nested calls become savepoints)."""
+    global _tx_depth
+    try:
+        with _LOCK:
+            if _tx_depth == 0:
+                _WRITER.execute("BEGIN IMMEDIATE")
+            else:
+                _WRITER.execute(f"SAVEPOINT sp_{_tx_depth}")
+            _tx_depth += 1
+    except Exception as e:
+        return {"error": f"DB begin error: {e}"}
+    return {"result": {"depth": _tx_depth}}
+
+def handle_commit(_params):
+    """Commit the innermost client transaction (RELEASE for a savepoint)."""
+    global _tx_depth
+    if _tx_depth == 0:
+        return _ERR_NO_TRANSACTION
+    try:
+        with _LOCK:
+            if _tx_depth == 1:
+                _WRITER.execute("COMMIT")
+            else:
+                _WRITER.execute(f"RELEASE sp_{_tx_depth - 1}")
+            _tx_depth -= 1
+    except Exception as e:
+        return {"error": f"DB commit error: {e}"}
+    return {"result": {"depth": _tx_depth}}
+
+def handle_rollback(_params):
+    """Undo the innermost client transaction."""
+    global _tx_depth
+    if _tx_depth == 0:
+        return _ERR_NO_TRANSACTION
+    try:
+        with _LOCK:
+            if _tx_depth == 1:
+                _WRITER.execute("ROLLBACK")
+            else:
+                sp = f"sp_{_tx_depth - 1}"
+                _WRITER.execute(f"ROLLBACK TO {sp}")
+                _WRITER.execute(f"RELEASE {sp}")
+            _tx_depth -= 1
+            # Rolled-back writes had advanced the ID counter / known emails
+            resync_caches()
+    except Exception as e:
+        return {"error": f"DB rollback error: {e}"}
+    return {"result": {"depth": _tx_depth}}
+
+def handle_ping(_params):
+    return {"result": {"ok": True}}
+
+# -----------------------------
+# DISPATCH
+# -----------------------------
+# method -> handler; one dict lookup per request instead of an if/elif ladder.
+# Register new tools here (and describe them in TOOLS).
+_HANDLERS = {
+    "add_user": handle_add_user,
+    "add_users": handle_add_users,
+    "list_users": handle_list_users,
+    "get_user": handle_get_user,
+    "get_users": handle_get_users,
+    "update_user": handle_update_user,
+    "update_users": handle_update_users,
+    "delete_user": handle_delete_user,
+    "delete_users": handle_delete_users,
+    "list_tools": handle_list_tools,
+    "send_email": handle_send_email,  # <— remove to hide the demo tool
+    # Not in TOOLS: transaction control for scripted clients, not the chat UI
+    "begin": handle_begin,
+    "commit": handle_commit,
+    "rollback": handle_rollback,
+    "ping": handle_ping,
+}
 
 # -----------------------------
 # MAIN LOOP (STDIO)
@@ -278,42 +774,38 @@ def handle_list_tools(_params):
 def main_loop():
     init_db()
     # Clear statement: STDIO (no TCP host/port)
+    # Line-buffered: each newline-terminated log line is one write, no manual flush
+    sys.stderr.reconfigure(line_buffering=True)
     sys.stderr.write("[MCP SERVER] Started and ready — transport=STDIO (no host/port)\n")
-    sys.stderr.flush()
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
+    stdin = sys.stdin.buffer
+    while True:
+        try:
+            body = read_request(stdin)
+        except ValueError as e:
+            send_response({"error": f"invalid frame header: {e}"})
             continue
+        if body is None:
+            close_db()
+            break
         try:
-            req = json.loads(line)
-        except Exception as e:
+            req = orjson.loads(body)  # parses the raw frame bytes, no decode step
+        except orjson.JSONDecodeError as e:
             send_response({"error": f"invalid json: {e}"})
             continue
 
         method = req.get("method")
         params = req.get("params", {}) or {}
 
-        if method == "add_user":
-            resp = handle_add_user(params)
-        elif method == "list_users":
-            resp = handle_list_users(params)
-        elif method == "get_user":
-            resp = handle_get_user(params)
-        elif method == "update_user":
-            resp = handle_update_user(params)
-        elif method == "delete_user":
-            resp = handle_delete_user(params)
-        elif method == "list_tools":
-            resp = handle_list_tools(params)
-        elif method == "send_email":
-            resp = handle_send_email(params)  # <— uncomment for demo
-        elif method == "ping":
-            resp = {"result": {"ok": True}}
-        else:
-            resp = {"error": f"unknown method: {method}"}
+        handler = _HANDLERS.get(method)
+        resp = handler(params) if handler else {"error": f"unknown method: {method}"}
 
-        send_response({"id": req.get("id"), "method": method, **resp})
+        if isinstance(resp, bytes):
+            # Pre-serialized members (list_tools): only the envelope is encoded
+            head = orjson.dumps({"id": req.get("id"), "method": method})
+            send_frame(head[:-1] + b"," + resp + b"}")
+        else:
+            send_response({"id": req.get("id"), "method": method, **resp})
 
 if __name__ == "__main__":
     main_loop()